@@ -1,102 +1,229 @@
 
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-from groq import Groq
-import json
-import random
-from faker import Faker
-import PyPDF2
+import numpy as np
+import threading
+import time
 from datetime import datetime
+try:
+    # orjson (opcional) parsea JSON bastante más rápido que la librería estándar
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+# plotly, groq, faker y fitz (PyMuPDF) se importan dentro de las funciones que
+# los usan para no cargarlos en el arranque
 
 # Configuración de la página
 st.set_page_config(page_title="MVP Diagnóstico Formación AI", layout="wide")
 
-# Inicializar Faker para datos aleatorios
-fake = Faker('es_ES')
-
 # --- 1. SIMULACIÓN DE BASE DE DATOS (BACKEND) ---
 @st.cache_data
 def generate_mock_database():
     """Genera una base de datos simulada de expertos y recursos."""
-    experts = []
+    from faker import Faker
+
+    # Inicializar Faker para datos aleatorios
+    fake = Faker('es_ES')
+    n_experts = 15
     specialties = ['Liderazgo', 'Python & Data', 'Soft Skills', 'Agile', 'Ventas', 'Ciberseguridad']
+    rng = np.random.default_rng(0)
     
-    for i in range(15):
-        experts.append({
-            "id": f"EXP-{i+100}",
-            "name": fake.name(),
-            "specialty": random.choice(specialties),
-            "rating": round(random.uniform(3.5, 5.0), 1),
-            "hourly_rate": random.randint(50, 200),
-            "email": fake.email()
-        })
-    return pd.DataFrame(experts)
+    # Columnas numéricas generadas de forma vectorizada; Faker sigue siendo por fila
+    experts = pd.DataFrame({
+        "id": [f"EXP-{i+100}" for i in range(n_experts)],
+        "name": [fake.name() for _ in range(n_experts)],
+        "specialty": rng.choice(specialties, n_experts),
+        "rating": rng.uniform(3.5, 5.0, n_experts).round(1),
+        "hourly_rate": rng.integers(50, 201, n_experts),
+        "email": [fake.email() for _ in range(n_experts)]
+    })
+    # Especialidad categórica: las comparaciones se hacen sobre códigos enteros
+    return experts.astype({"specialty": "category", "hourly_rate": "int32"})
+
+@st.cache_data
+def index_by_specialty(df):
+    """Índice de filas (posiciones) por especialidad para filtrar sin recorrer la tabla."""
+    return {s: np.flatnonzero(df["specialty"] == s) for s in df["specialty"].unique()}
+
+def select_by_specialty(df, specialty_index, query):
+    """Devuelve los expertos cuya especialidad contiene `query` usando el índice precalculado.
+
+    La coincidencia es parcial y sin distinguir mayúsculas, como una búsqueda semántica simple.
+    """
+    query = query.lower()
+    keys = [s for s in specialty_index if query in s.lower()]
+    if not keys:
+        return df.iloc[[]]
+    # Ordenamos las posiciones para conservar el orden original de la tabla
+    return df.iloc[np.sort(np.concatenate([specialty_index[s] for s in keys]))]
 
 # Cargar base de datos simulada
 experts_db = generate_mock_database()
+specialty_index = index_by_specialty(experts_db)
 
 # --- 2. FUNCIONES DE PROCESAMIENTO ---
-def extract_text_from_pdf(uploaded_file):
-    """Extrae texto de un archivo PDF cargado."""
+# Máximo de caracteres del PDF que se envían al modelo
+MAX_PDF_CHARS = 2000
+# Modelos de Groq disponibles (el primero, más pequeño y rápido, es el por defecto)
+GROQ_MODELS = ["llama-3.1-8b-instant", "llama-3.3-70b-versatile"]
+# Límite de tokens de salida: el JSON esperado es compacto
+MAX_COMPLETION_TOKENS = 600
+# Vida (segundos) y tamaño máximo del caché de diagnósticos
+DIAGNOSIS_CACHE_TTL = 3600
+DIAGNOSIS_CACHE_MAX_ENTRIES = 128
+# Campos del diagnóstico que usa el dashboard (se validan al recibir la respuesta)
+DIAGNOSIS_REQUIRED_FIELDS = ("diagnosis_summary", "identified_gaps", "recommended_plan", "recommended_specialties")
+# Esqueleto de campos que ve el modelo: mucho más corto que un JSON Schema completo
+DIAGNOSIS_SKELETON = ('{"diagnosis_summary":"max 50 palabras",'
+                      '"identified_gaps":[{"gap","severity":1-10,"category":"Tecnica|Blanda|Estrategica"}],'
+                      '"recommended_plan":[{"module","duration":"horas","objective"}],'
+                      '"recommended_specialties":[str]}')
+
+@st.cache_data(show_spinner=False)
+def _extract_pdf_bytes(pdf_bytes, max_chars):
+    """Extrae texto de los bytes de un PDF (cacheado por contenido del archivo)."""
+    import fitz  # PyMuPDF
+
+    # PyMuPDF (MuPDF en C) es mucho más rápido que PyPDF2 para extraer texto
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    parts = []
+    total_len = 0
+    for page in doc:
+        text = page.get_text("text")
+        parts.append(text)
+        total_len += len(text)
+        # Solo usamos los primeros max_chars: no parseamos páginas de más
+        if total_len >= max_chars:
+            break
+    doc.close()
+    return "".join(parts)[:max_chars]
+
+def extract_text_from_pdf(uploaded_file, max_chars=MAX_PDF_CHARS):
+    """Extrae texto de un archivo PDF cargado (hasta max_chars caracteres)."""
     if uploaded_file is None:
         return ""
-    reader = PyPDF2.PdfReader(uploaded_file)
-    text = ""
-    for page in reader.pages:
-        text += page.extract_text()
-    return text
+    # Pasamos los bytes (hasheables) y no el UploadedFile para que el caché
+    # sea estable entre reruns con el mismo archivo
+    return _extract_pdf_bytes(uploaded_file.getvalue(), max_chars)
 
-def get_ai_diagnosis(api_key, pain_points, strategy_text):
-    """Consulta a Groq para obtener el diagnóstico en formato JSON."""
-    client = Groq(api_key=api_key)
+@st.cache_resource
+def _diagnosis_cache():
+    """Caché compartido de diagnósticos indexado por (dolores, texto PDF, modelo).
+
+    Cada entrada guarda (momento de creación, diagnóstico) y caduca a los
+    DIAGNOSIS_CACHE_TTL segundos. La API Key no forma parte de la clave del caché.
+    Se comparte entre sesiones, por eso va acompañado de un lock.
+    """
+    return threading.Lock(), {}
+
+@st.cache_resource(max_entries=8)
+def _groq_client(api_key):
+    """Cliente de Groq reutilizado entre llamadas (mantiene vivas las conexiones HTTP)."""
+    from groq import Groq
+
+    return Groq(api_key=api_key)
+
+def _stream_diagnosis(api_key, pain_points, strategy_text, model):
+    """Llama a Groq en modo streaming y va entregando los fragmentos de texto."""
+    client = _groq_client(api_key)
     
     # Contexto para el modelo (Prompt Engineering)
-    system_prompt = """
-    Actúa como un Consultor Senior de RRHH experto en Formación Corporativa.
-    Tu tarea es analizar los dolores de la empresa y su estrategia para generar un plan de formación.
-    
-    IMPORTANTE: Tu respuesta debe ser EXCLUSIVAMENTE un objeto JSON válido con la siguiente estructura, sin texto adicional antes o después:
-    {
-        "diagnosis_summary": "Resumen ejecutivo del problema detectado (max 50 palabras)",
-        "identified_gaps": [
-            {"gap": "Nombre de la brecha", "severity": score_1_to_10, "category": "Tecnica/Blanda/Estrategica"}
-        ],
-        "recommended_plan": [
-            {"module": "Nombre del modulo", "duration": "Horas estimadas", "objective": "Objetivo de aprendizaje"}
-        ],
-        "recommended_specialties": ["Especialidad1", "Especialidad2"] 
-    }
-    """
+    system_prompt = f"Eres un consultor de RRHH. Responde solo con JSON con esta estructura: {DIAGNOSIS_SKELETON}"
     
     user_content = f"""
     DOLORES/NECESIDADES: {pain_points}
     
-    CONTEXTO ESTRATÉGICO (PDF): {strategy_text[:2000]} (texto truncado para eficiencia)
+    CONTEXTO ESTRATÉGICO (PDF): {strategy_text} (texto truncado para eficiencia)
     """
     
+    completion = client.chat.completions.create(
+        model=model,
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_content}
+        ],
+        temperature=0.1,
+        max_tokens=MAX_COMPLETION_TOKENS,
+        # Sin response_format: Groq no admite modo JSON ni json_schema con streaming, confiamos en el prompt
+        stream=True
+    )
+    for chunk in completion:
+        yield chunk.choices[0].delta.content or ""
+
+def extract_json_object(raw):
+    """Recorta el texto del modelo al objeto JSON (sin modo JSON puede venir con texto o ``` alrededor)."""
+    start, end = raw.find("{"), raw.rfind("}")
+    return raw[start:end + 1] if start != -1 and end > start else raw
+
+def validate_diagnosis(result):
+    """Comprueba que el diagnóstico tenga los campos y tipos que usa el dashboard."""
+    if not isinstance(result, dict):
+        raise ValueError("La respuesta no es un objeto JSON")
+    missing = [key for key in DIAGNOSIS_REQUIRED_FIELDS if key not in result]
+    if missing:
+        raise ValueError(f"Faltan campos en la respuesta: {', '.join(missing)}")
+    for key in ("identified_gaps", "recommended_plan"):
+        if not isinstance(result[key], list) or not all(isinstance(item, dict) for item in result[key]):
+            raise ValueError(f"'{key}' debe ser una lista de objetos")
+    specialties = result["recommended_specialties"]
+    if not isinstance(specialties, list) or not all(isinstance(item, str) for item in specialties):
+        raise ValueError("'recommended_specialties' debe ser una lista de textos")
+    return result
+
+def get_ai_diagnosis(api_key, pain_points, strategy_text, model=GROQ_MODELS[0]):
+    """Consulta a Groq para obtener el diagnóstico en formato JSON."""
+    cache_lock, cache = _diagnosis_cache()
+    cache_key = (pain_points, strategy_text, model)
+    with cache_lock:
+        entry = cache.get(cache_key)
+    if entry and time.monotonic() - entry[0] < DIAGNOSIS_CACHE_TTL:
+        return entry[1]
+
+    # Mostramos los tokens a medida que llegan y limpiamos al terminar (también si falla)
+    placeholder = st.empty()
     try:
-        completion = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_content}
-            ],
-            temperature=0.1,
-            response_format={"type": "json_object"} # Forzamos modo JSON si está disponible o confiamos en el prompt
-        )
-        return json.loads(completion.choices[0].message.content)
+        raw = placeholder.write_stream(_stream_diagnosis(api_key, pain_points, strategy_text, model))
+        result = validate_diagnosis(json_loads(extract_json_object(raw)))
     except Exception as e:
+        # Los fallos no se guardan en el caché
         st.error(f"Error al conectar con Groq o procesar JSON: {e}")
         return None
+    finally:
+        placeholder.empty()
+
+    now = time.monotonic()
+    with cache_lock:
+        # Quitamos las entradas caducadas y, si sigue lleno, las más antiguas
+        for key in [k for k, (created, _) in cache.items() if now - created >= DIAGNOSIS_CACHE_TTL]:
+            del cache[key]
+        cache.pop(cache_key, None)
+        while len(cache) >= DIAGNOSIS_CACHE_MAX_ENTRIES:
+            del cache[next(iter(cache))]
+        cache[cache_key] = (now, result)
+    return result
+
+@st.cache_data(show_spinner=False)
+def build_radar_chart(gaps):
+    """Construye el gráfico radar de brechas y lo devuelve serializado a JSON."""
+    import plotly.graph_objects as go
+
+    # Listas planas (sin DataFrame); repetimos el primer punto para cerrar la línea
+    gap_names = [gap for gap, _ in gaps]
+    severities = [severity for _, severity in gaps]
+    # Traza WebGL en lugar de SVG
+    fig_radar = go.Figure(go.Scatterpolargl(r=severities + severities[:1], theta=gap_names + gap_names[:1],
+                                            fill='toself', mode='lines+markers'))
+    fig_radar.update_layout(title="Severidad de Brechas Detectadas", template="plotly_dark")
+    return fig_radar.to_json()
 
 # --- 3. INTERFAZ DE USUARIO (FRONTEND) ---
 
 # Sidebar: Configuración
 st.sidebar.image("https://cdn-icons-png.flaticon.com/512/3135/3135715.png", width=50)
 st.sidebar.title("Configuración")
-groq_api_key = st.sidebar.text_input("Groq API Key", type="password", help="Ingresa tu API Key de Groq para activar el cerebro de IA.")
+# Quitamos espacios: una clave solo con espacios no pasa la validación y un pegado con ruido no crea otro cliente
+groq_api_key = st.sidebar.text_input("Groq API Key", type="password", help="Ingresa tu API Key de Groq para activar el cerebro de IA.").strip()
+groq_model = st.sidebar.selectbox("Modelo de IA", GROQ_MODELS, help="El modelo 8B responde más rápido; el 70B da diagnósticos más detallados.")
 st.sidebar.markdown("---")
 st.sidebar.info("Este MVP simula el flujo técnico de diagnóstico de formación automatizado.")
 
@@ -129,12 +256,48 @@ if process_btn:
             pdf_text = extract_text_from_pdf(uploaded_file) if uploaded_file else "No se proporcionó PDF, basar solo en dolores."
             
             # 2. IA Engine
-            diagnosis_result = get_ai_diagnosis(groq_api_key, pain_points, pdf_text)
+            diagnosis_result = get_ai_diagnosis(groq_api_key, pain_points, pdf_text, groq_model)
             
             if diagnosis_result:
                 # Guardar en estado de sesión para no perderlo al refrescar filtros
                 st.session_state['diagnosis'] = diagnosis_result
                 st.session_state['processed'] = True
+                # Opciones del filtro y máscara de expertos recomendados, estables entre reruns
+                rec_specialties = diagnosis_result.get('recommended_specialties', [])
+                st.session_state['filter_opts'] = ("Todos", *rec_specialties)
+                st.session_state['rec_mask'] = experts_db['specialty'].isin(rec_specialties).to_numpy()
+
+@st.fragment
+def render_experts_section():
+    """Filtro y tarjetas de expertos; se re-ejecuta solo este bloque al interactuar."""
+    # Filtro visual para el usuario
+    selected_filter = st.selectbox("Filtrar Expertos por Especialidad Sugerida:", st.session_state['filter_opts'])
+
+    if selected_filter != "Todos":
+        # Filtramos simulando búsqueda semántica simple
+        filtered_experts = select_by_specialty(experts_db, specialty_index, selected_filter)
+        # Si no hay match exacto, mostramos random para demo
+        if filtered_experts.empty:
+             filtered_experts = experts_db.sample(3)
+    else:
+        # Si es "Todos", mostramos una mezcla basada en las recomendaciones
+        # La máscara se calcula una sola vez al guardar el diagnóstico
+        filtered_experts = experts_db.iloc[st.session_state['rec_mask']]
+        if filtered_experts.empty:
+            filtered_experts = experts_db.sample(5)
+
+    # Mostrar tarjetas de expertos
+    for expert in filtered_experts.itertuples(index=False):
+        with st.expander(f"🎓 {expert.name} - Especialista en {expert.specialty}"):
+            ec1, ec2 = st.columns([3, 1])
+            with ec1:
+                st.write(f"**ID:** {expert.id}")
+                st.write(f"**Valoración:** ⭐ {expert.rating}/5.0")
+                st.write(f"**Tarifa:** ${expert.hourly_rate}/hora")
+            with ec2:
+                if st.button(f"Agendar con {expert.name.split()[0]}", key=expert.id):
+                    # Simulación de Disparador de Evento (Email/Calendar)
+                    st.success(f"✅ Solicitud enviada a {expert.email}. Se ha creado el evento en Google Calendar.")
 
 # --- 4. DASHBOARD DE RESULTADOS ---
 if st.session_state.get('processed'):
@@ -143,11 +306,18 @@ if st.session_state.get('processed'):
     st.markdown("---")
     st.subheader("2. Dashboard de Resultados")
     
+    # DataFrames construidos una sola vez por rerun para métricas y visualizaciones
+    df_gaps = pd.DataFrame(data['identified_gaps'])
+    df_plan = pd.DataFrame(data['recommended_plan'])
+    
     # Métricas y Resumen
     m1, m2, m3 = st.columns(3)
-    m1.metric("Brechas Identificadas", len(data['identified_gaps']))
-    m2.metric("Módulos Sugeridos", len(data['recommended_plan']))
-    m3.metric("Severidad Promedio", round(sum(d['severity'] for d in data['identified_gaps'])/len(data['identified_gaps']), 1))
+    m1.metric("Brechas Identificadas", len(df_gaps))
+    m2.metric("Módulos Sugeridos", len(df_plan))
+    # La respuesta del modelo no garantiza las claves: solo promediamos si hay severidades numéricas
+    has_severity = ('severity' in df_gaps and pd.api.types.is_numeric_dtype(df_gaps['severity'])
+                    and df_gaps['severity'].notna().any())
+    m3.metric("Severidad Promedio", round(float(df_gaps['severity'].mean()), 1) if has_severity else "—")
     
     st.info(f"**Diagnóstico:** {data['diagnosis_summary']}")
     
@@ -156,53 +326,27 @@ if st.session_state.get('processed'):
     
     with c_chart1:
         st.markdown("#### Mapa de Brechas (Radar)")
-        df_gaps = pd.DataFrame(data['identified_gaps'])
         
         # Gráfico Radar
-        if not df_gaps.empty:
-            fig_radar = px.line_polar(df_gaps, r='severity', theta='gap', line_close=True, 
-                                      title="Severidad de Brechas Detectadas",
-                                      template="plotly_dark")
-            fig_radar.update_traces(fill='toself')
-            st.plotly_chart(fig_radar, use_container_width=True)
+        if has_severity and 'gap' in df_gaps:
+            # La tupla de pares (brecha, severidad) es la clave del caché del gráfico
+            df_radar = df_gaps[['gap', 'severity']].dropna()
+            radar_json = build_radar_chart(tuple(zip(df_radar['gap'].tolist(), df_radar['severity'].tolist())))
+            # st.plotly_chart vuelve a serializar el spec; lo que se ahorra es reconstruir la figura
+            st.plotly_chart(json_loads(radar_json), use_container_width=True, config={"responsive": True})
             
     with c_chart2:
         st.markdown("#### Plan de Formación Sugerido")
-        df_plan = pd.DataFrame(data['recommended_plan'])
-        st.dataframe(df_plan, hide_index=True, use_container_width=True)
+        # Tabla estática con solo las columnas del plan (más ligera que st.dataframe);
+        # si el modelo no respetó las claves, mostramos lo que devolvió
+        plan_columns = ['module', 'duration', 'objective']
+        if set(plan_columns).issubset(df_plan.columns):
+            st.table(df_plan[plan_columns].set_index('module'))
+        else:
+            st.table(df_plan)
 
     # --- FILTRADO Y RECOMENDACIÓN DE EXPERTOS ---
     st.markdown("---")
     st.subheader("3. Expertos Recomendados & Agendamiento")
     
-    # Lógica de match (simple string matching con las especialidades recomendadas por la IA)
-    rec_specialties = data.get('recommended_specialties', [])
-    
-    # Filtro visual para el usuario
-    selected_filter = st.selectbox("Filtrar Expertos por Especialidad Sugerida:", ["Todos"] + rec_specialties)
-    
-    if selected_filter != "Todos":
-        # Filtramos simulando búsqueda semántica simple
-        filtered_experts = experts_db[experts_db['specialty'].str.contains(selected_filter, case=False, na=False)]
-        # Si no hay match exacto, mostramos random para demo
-        if filtered_experts.empty:
-             filtered_experts = experts_db.sample(3)
-    else:
-        # Si es "Todos", mostramos una mezcla basada en las recomendaciones
-        filtered_experts = experts_db[experts_db['specialty'].isin(rec_specialties)]
-        if filtered_experts.empty:
-            filtered_experts = experts_db.sample(5)
-
-    # Mostrar tarjetas de expertos
-    for index, row in filtered_experts.iterrows():
-        with st.expander(f"🎓 {row['name']} - Especialista en {row['specialty']}"):
-            ec1, ec2 = st.columns([3, 1])
-            with ec1:
-                st.write(f"**ID:** {row['id']}")
-                st.write(f"**Valoración:** ⭐ {row['rating']}/5.0")
-                st.write(f"**Tarifa:** ${row['hourly_rate']}/hora")
-            with ec2:
-                if st.button(f"Agendar con {row['name'].split()[0]}", key=row['id']):
-                    # Simulación de Disparador de Evento (Email/Calendar)
-                    st.success(f"✅ Solicitud enviada a {row['email']}. Se ha creado el evento en Google Calendar.")
-                    st.balloons()
+    render_experts_section()